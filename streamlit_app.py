@@ -1,78 +1,141 @@
+import hashlib
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from types import MappingProxyType
 from typing import Dict, Optional, Tuple
+import numpy as np
+import orjson
 import pandas as pd
+import pyarrow as pa
 import requests
 import streamlit as st
-import plotly.express as px
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
 
 OPENWEATHER_BASE_URL = "https://api.openweathermap.org/data/2.5"
+MAX_PLOT_POINTS = 500
+DOWNSAMPLE_THRESHOLD = 1000
+FORECAST_FIELDS = (
+    ("main", "temp", float("nan")),
+    ("main", "feels_like", float("nan")),
+    ("main", "humidity", float("nan")),
+    ("wind", "speed", float("nan")),
+    ("weather", "description", ""),
+    ("weather", "icon", None),
+)
+PLOT_COLUMNS = ("dt", "main.temp", "main.humidity", "wind.speed")
+UNIT_LABELS = MappingProxyType({"metric": "Метрика (°C, м/с)", "imperial": "Империал (°F, mph)"})
+UNIT_SYMBOLS = MappingProxyType({"metric": ("°C", "м/с"), "imperial": ("°F", "mph")})
+DISPLAY_COLUMNS = MappingProxyType(
+    {
+        units: MappingProxyType(
+            {
+                "dt_txt": "Время",
+                "main.temp": f"Температура, {units_temp}",
+                "main.feels_like": f"Ощущается, {units_temp}",
+                "main.humidity": "Влажность, %",
+                "wind.speed": f"Ветер, {units_wind}",
+                "weather.description": "Описание",
+            }
+        )
+        for units, (units_temp, units_wind) in UNIT_SYMBOLS.items()
+    }
+)
+
+
+@st.cache_resource
+def get_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=4,
+        max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=[502, 503, 504], raise_on_status=False),
+    )
+    session.mount("https://", adapter)
+    return session
 
-@st.cache_data(show_spinner=False)
-def fetch_current_weather(city: str, api_key: str, units: str, lang: str) -> Tuple[Optional[Dict], Optional[str]]:
+
+def fetch_current_weather(session: requests.Session, city: str, api_key: str, units: str, lang: str) -> Tuple[Optional[Dict], Optional[str]]:
     params = {"q": city, "appid": api_key, "units": units, "lang": lang}
     try:
-        response = requests.get(f"{OPENWEATHER_BASE_URL}/weather", params=params, timeout=15)
+        response = session.get(f"{OPENWEATHER_BASE_URL}/weather", params=params, timeout=15)
         if response.status_code == 200:
-            return response.json(), None
+            return orjson.loads(response.content), None
         try:
-            err_json = response.json()
+            err_json = orjson.loads(response.content)
             message = err_json.get("message") or str(err_json)
         except Exception:
             message = response.text
         return None, f"HTTP {response.status_code}: {message}"
     except requests.RequestException as exc:
         return None, f"Network error: {exc}"
+    except orjson.JSONDecodeError as exc:
+        return None, f"Invalid JSON: {exc}"
 
 
-@st.cache_data(show_spinner=False)
-def fetch_forecast(city: str, api_key: str, units: str, lang: str) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
+def fetch_forecast(session: requests.Session, city: str, api_key: str, units: str, lang: str) -> Tuple[Optional[pd.DataFrame], Optional[Dict[str, np.ndarray]], Optional[str]]:
     params = {"q": city, "appid": api_key, "units": units, "lang": lang}
     try:
-        response = requests.get(f"{OPENWEATHER_BASE_URL}/forecast", params=params, timeout=15)
+        response = session.get(f"{OPENWEATHER_BASE_URL}/forecast", params=params, timeout=15)
         if response.status_code != 200:
             try:
-                err_json = response.json()
+                err_json = orjson.loads(response.content)
                 message = err_json.get("message") or str(err_json)
             except Exception:
                 message = response.text
-            return None, f"HTTP {response.status_code}: {message}"
-        data = response.json()
+            return None, None, f"HTTP {response.status_code}: {message}"
+        data = orjson.loads(response.content)
         list_items = data.get("list", [])
         if not list_items:
-            return None, "Empty forecast list from API"
-
-        df = pd.DataFrame(list_items)
-        main_df = pd.json_normalize(df["main"]).add_prefix("main.")
-        wind_df = pd.json_normalize(df["wind"]).add_prefix("wind.")
-        weather_main = df["weather"].apply(lambda x: x[0] if isinstance(x, list) and x else {})
-        weather_df = pd.json_normalize(weather_main).add_prefix("weather.")
-        clouds_df = pd.json_normalize(df.get("clouds", {})).add_prefix("clouds.")
-
-        result = pd.concat(
-            [
-                pd.to_datetime(df["dt"], unit="s").rename("dt"),
-                df["dt_txt"].rename("dt_txt"),
-                main_df,
-                wind_df,
-                weather_df,
-                clouds_df,
-            ],
-            axis=1,
-        )
-        for col, default in [
-            ("main.temp", None),
-            ("main.feels_like", None),
-            ("main.humidity", None),
-            ("wind.speed", None),
-            ("weather.description", ""),
-        ]:
-            if col not in result.columns:
-                result[col] = default
-
-        return result, None
+            return None, None, "Empty forecast list from API"
+
+        weather_rows = [(it["weather"][0] if isinstance(it.get("weather"), list) and it["weather"] else {}) for it in list_items]
+        cols: Dict[str, list] = {"dt": [], "dt_txt": []}
+        field_values = [cols.setdefault(f"{prefix}.{key}", []) for prefix, key, _ in FORECAST_FIELDS]
+        for it, weather_row in zip(list_items, weather_rows):
+            cols["dt"].append(it["dt"])
+            cols["dt_txt"].append(it.get("dt_txt"))
+            groups = {"main": it.get("main") or {}, "wind": it.get("wind") or {}, "weather": weather_row if isinstance(weather_row, dict) else {}}
+            for (prefix, key, default), values in zip(FORECAST_FIELDS, field_values):
+                values.append(groups[prefix].get(key, default))
+
+        cols["dt"] = np.asarray(cols["dt"], dtype="int64").view("datetime64[s]").astype("datetime64[ns]")
+        result = pd.DataFrame(cols)
+
+        series = {col: result[col].to_numpy() for col in PLOT_COLUMNS}
+        return result, series, None
     except requests.RequestException as exc:
-        return None, f"Network error: {exc}"
+        return None, None, f"Network error: {exc}"
+    except orjson.JSONDecodeError as exc:
+        return None, None, f"Invalid JSON: {exc}"
+
+
+class WeatherFetchError(Exception):
+    def __init__(self, current: Optional[Dict], forecast_df: Optional[pd.DataFrame], forecast_series: Optional[Dict[str, np.ndarray]], errors: Dict[str, Optional[str]]) -> None:
+        super().__init__("; ".join(err for err in errors.values() if err))
+        self.current = current
+        self.forecast_df = forecast_df
+        self.forecast_series = forecast_series
+        self.errors = errors
+
+
+# No persist="disk" here: Streamlit ignores ttl for persisted caches, and weather must expire.
+@st.cache_data(ttl=600, show_spinner=False, max_entries=64)
+def fetch_weather_bundle(city: str, api_key_hash: str, _api_key: str, units: str, lang: str) -> Tuple[Dict, pd.DataFrame, Dict[str, np.ndarray], float]:
+    session = get_session()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        current_future = executor.submit(fetch_current_weather, session, city, _api_key, units, lang)
+        forecast_future = executor.submit(fetch_forecast, session, city, _api_key, units, lang)
+        current, current_err = current_future.result()
+        forecast_df, forecast_series, forecast_err = forecast_future.result()
+    if current_err or forecast_err:
+        raise WeatherFetchError(current, forecast_df, forecast_series, {"current": current_err, "forecast": forecast_err})
+    return current, forecast_df, forecast_series, time.time()
+
 
 def get_api_key_from_env_or_ui() -> Tuple[Optional[str], bool]:
     api_key = None
@@ -101,6 +164,49 @@ def format_location_block(current: Dict) -> str:
     return f"{name}, {country}" if name else "—"
 
 
+def _downsample_minmax(x: np.ndarray, y: np.ndarray, n_out: int = MAX_PLOT_POINTS) -> Tuple[np.ndarray, np.ndarray]:
+    if len(x) <= DOWNSAMPLE_THRESHOLD:
+        return x, y
+    values = np.asarray(y, dtype=float)
+    edges = np.linspace(0, len(values), n_out // 2 + 1, dtype=int)
+    keep = []
+    for start, stop in zip(edges[:-1], edges[1:]):
+        chunk = values[start:stop]
+        if np.isnan(chunk).all():
+            keep.append(start)
+            continue
+        keep.extend((start + np.nanargmin(chunk), start + np.nanargmax(chunk)))
+    idx = np.unique(keep)
+    return x[idx], y[idx]
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def build_forecast_figure(forecast_series: Dict[str, np.ndarray], units_temp: str, units_wind: str) -> go.Figure:
+    traces = [
+        ("main.temp", f"Температура по времени ({units_temp})", f"Температура, {units_temp}"),
+        ("main.humidity", "Влажность по времени (%)", "Влажность, %"),
+        ("wind.speed", f"Скорость ветра по времени ({units_wind})", f"Ветер, {units_wind}"),
+    ]
+    fig = make_subplots(rows=len(traces), cols=1, shared_xaxes=True, subplot_titles=[title for _, title, _ in traces])
+    for row, (col, _, label) in enumerate(traces, start=1):
+        x, y = _downsample_minmax(forecast_series["dt"], forecast_series[col])
+        fig.add_trace(
+            go.Scattergl(x=x, y=y, mode="lines+markers", name=label),
+            row=row,
+            col=1,
+        )
+        fig.update_yaxes(title_text=label, row=row, col=1)
+    fig.update_xaxes(title_text="Время", row=len(traces), col=1)
+    fig.update_layout(height=300 * len(traces), showlegend=False)
+    return fig
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def build_display_table(forecast_df: pd.DataFrame, units: str) -> pa.Table:
+    columns = DISPLAY_COLUMNS[units]
+    return pa.Table.from_pandas(forecast_df[list(columns)].rename(columns=dict(columns)), preserve_index=False)
+
+
 def main() -> None:
     st.set_page_config(page_title="Прогноз погоды", page_icon="☀️", layout="wide")
     st.title("Прогноз погоды с визуализацией")
@@ -109,7 +215,7 @@ def main() -> None:
         st.header("Настройки")
         default_city = "Almaty"
         city = st.text_input("Город", value=default_city)
-        units_label = st.radio("Единицы измерения", options=["metric", "imperial"], format_func=lambda x: "Метрика (°C, м/с)" if x == "metric" else "Империал (°F, mph)")
+        units_label = st.radio("Единицы измерения", options=list(UNIT_LABELS), format_func=UNIT_LABELS.get)
         lang = st.selectbox("Язык", options=["ru", "en"], index=0)
         api_key, from_secrets = get_api_key_from_env_or_ui()
 
@@ -117,15 +223,23 @@ def main() -> None:
         st.warning("Укажите API ключ OpenWeather в боковой панели или через secrets.")
         st.stop()
 
+    api_key_hash = hashlib.sha256(api_key.encode()).hexdigest()
+    try:
+        current, forecast_df, forecast_series, fetched_at = fetch_weather_bundle(city, api_key_hash, api_key, units_label, lang)
+        errors: Dict[str, Optional[str]] = {"current": None, "forecast": None}
+    except WeatherFetchError as exc:
+        current, forecast_df, forecast_series, errors = exc.current, exc.forecast_df, exc.forecast_series, exc.errors
+        fetched_at = time.time()
+    units_temp, units_wind = UNIT_SYMBOLS[units_label]
+
     col1, col2 = st.columns([1, 2])
 
     with col1:
         st.subheader("Текущая погода")
-        current, current_err = fetch_current_weather(city, api_key, units_label, lang)
         if not current:
             st.error("Не удалось получить текущую погоду. Проверьте название города и ключ API.")
-            if current_err:
-                st.code(current_err)
+            if errors["current"]:
+                st.code(errors["current"])
         else:
             location_str = format_location_block(current)
             weather = (current.get("weather") or [{}])[0]
@@ -138,9 +252,6 @@ def main() -> None:
             humidity = main.get("humidity")
             wind_speed = wind.get("speed")
 
-            units_temp = "°C" if units_label == "metric" else "°F"
-            units_wind = "м/с" if units_label == "metric" else "mph"
-
             st.metric(label=f"{location_str}", value=f"{temp} {units_temp}" if temp is not None else "—", delta=f"Ощущается как {feels} {units_temp}" if feels is not None else None)
             cols = st.columns(2)
             with cols[0]:
@@ -153,58 +264,20 @@ def main() -> None:
 
     with col2:
         st.subheader("Прогноз (5 дней / 3 часа)")
-        forecast_df, forecast_err = fetch_forecast(city, api_key, units_label, lang)
         if forecast_df is None or forecast_df.empty:
             st.error("Не удалось получить прогноз. Проверьте название города и ключ API.")
-            if forecast_err:
-                st.code(forecast_err)
+            if errors["forecast"]:
+                st.code(errors["forecast"])
         else:
-            units_temp = "°C" if units_label == "metric" else "°F"
-            fig_temp = px.line(
-                forecast_df,
-                x="dt",
-                y="main.temp",
-                title=f"Температура по времени ({units_temp})",
-                markers=True,
-                labels={"dt": "Время", "main.temp": f"Температура, {units_temp}"},
-            )
-            fig_temp.update_traces(mode="lines+markers")
-            st.plotly_chart(fig_temp, use_container_width=True)
-
-            fig_hum = px.line(
-                forecast_df,
-                x="dt",
-                y="main.humidity",
-                title="Влажность по времени (%)",
-                markers=True,
-                labels={"dt": "Время", "main.humidity": "Влажность, %"},
-            )
-            st.plotly_chart(fig_hum, use_container_width=True)
-
-            wind_units = "м/с" if units_label == "metric" else "mph"
-            fig_wind = px.line(
-                forecast_df,
-                x="dt",
-                y="wind.speed",
-                title=f"Скорость ветра по времени ({wind_units})",
-                markers=True,
-                labels={"dt": "Время", "wind.speed": f"Ветер, {wind_units}"},
-            )
-            st.plotly_chart(fig_wind, use_container_width=True)
+            figure_key = (units_label, fetched_at)
+            if st.session_state.get("forecast_figure_key") != figure_key:
+                st.session_state.forecast_figure = build_forecast_figure(forecast_series, units_temp, units_wind)
+                st.session_state.forecast_figure_key = figure_key
+            st.plotly_chart(st.session_state.forecast_figure, use_container_width=True)
 
             with st.expander("Таблица прогноза"):
-                display_cols = ["dt_txt", "main.temp", "main.feels_like", "main.humidity", "wind.speed", "weather.description"]
-                show_df = forecast_df[display_cols].rename(
-                    columns={
-                        "dt_txt": "Время",
-                        "main.temp": f"Температура, {units_temp}",
-                        "main.feels_like": f"Ощущается, {units_temp}",
-                        "main.humidity": "Влажность, %",
-                        "wind.speed": f"Ветер, {wind_units}",
-                        "weather.description": "Описание",
-                    }
-                )
-                st.dataframe(show_df, use_container_width=True, hide_index=True)
+                show_table = build_display_table(forecast_df, units_label)
+                st.dataframe(show_table, use_container_width=True, hide_index=True)
 
     st.caption("Источник данных: OpenWeather. Приложение: Streamlit + Plotly.")
 